@@ -0,0 +1,46 @@
+import cython
+
+
+cdef class SentenceNode:
+    cdef public list word_nodes
+    cdef public str text
+    cdef public object doc
+    cdef public bint has_there
+
+
+cdef class WordNode:
+    cdef public object wn_id
+    cdef public Py_ssize_t index
+    cdef public list index_span
+    cdef public str text
+    cdef public SentenceNode sentence_node
+    cdef public str lemma
+    cdef public str upos
+    cdef public str feats
+    cdef public list span
+    cdef public object ner
+    cdef public WordNode ner_head_word
+    cdef public str dependency_relation
+    cdef public object governor
+    cdef public WordNode governor_word
+    cdef public list dependents
+
+
+cpdef set_governor(WordNode word_node, WordNode gov_node)
+
+@cython.locals(wn=WordNode)
+cpdef WordNode find_governed(WordNode word_node, str dep)
+
+@cython.locals(wn=WordNode)
+cpdef WordNode find_subj(WordNode word_node)
+
+@cython.locals(word_node=WordNode)
+cpdef redirect_dependants(WordNode from_node, WordNode to_node)
+
+cpdef bint make_copula(WordNode head_node, WordNode be_node)
+
+@cython.locals(subj_node=WordNode)
+cpdef make_passive(WordNode be_node, WordNode verb_node)
+
+@cython.locals(word_node=WordNode, gov_node=WordNode)
+cpdef fix_advmod_cop(SentenceNode sent)
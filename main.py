@@ -1,3 +1,10 @@
+# cython: nonecheck=True
+import bisect
+import collections
+import itertools
+import operator
+import sys
+import types
 import spacy
 from spacy.tokens import Doc as SpacyDoc
 
@@ -14,16 +21,35 @@ ud_doc.print_doc()
 
 To create a Spacy doc, first create an instance of SpacyParser
 spr = SpacyParser()
+or, if named entities are not needed,
+spr = SpacyParser(disable=('ner',))
 
 To get a Spacy doc, use
 spacy_doc = spr.nlp('Spacy parser is pretty good')
 
+To parse many texts at once into UdDocs, use
+ud_docs = spr.parse_many(texts)
+
 To print a Spacy doc, use:
 print_spacy_doc(spacy_doc)
 """
 
+# NER phrase recorded on its head word: phrase text, word nodes, character span [start, end) and NER type
+NerInfo = collections.namedtuple('NerInfo', 'text words start end type', module=__name__)
+
+_NOMINAL = frozenset({'NOUN', 'PRON', 'PROPN'})  # nominal upos tags
+_IOBJ_AGENT = frozenset({'iobj', 'agent'})  # preposition relations that are not 'prep', see prep_chain
+_SUBJ_RELS = frozenset({'nsubj', 'csubj', 'nsubj:pass', 'csubj:pass', 'nsubj:outer', 'csubj:outer'})
+# dependants of a node that move with it when another node takes its place, see redirect_dependants
+_REDIRECTABLE_DEPS = frozenset({'prep', 'attr', 'advcl', 'advmod', 'acomp', 'xcomp', 'dep', 'acl', 'nsubj', 'obj',
+                                'csubj', 'ccomp', 'mark', 'cop', 'npadvmod', 'conj', 'parataxis', 'punct', 'cc',
+                                'nsubj:outer', 'csubj:outer'})
+_EMPTY_FEATS = types.MappingProxyType({})  # shared read-only features of words without features
+_word_index = operator.attrgetter('index')  # sort key keeping dependents in sentence order
+
 
 class UdDoc:
+    __slots__ = ('sentences',)
 
     def __init__(self):
         self.sentences = []
@@ -34,83 +60,155 @@ class UdDoc:
         :param count: would put a number on a sentence
         :return: nothing
         """
-        s: SentenceNode
+        # the whole document is written at once
+        lines = []
         for s in self.sentences:
             txt = s.text
             if count > 0:
                 txt = f"\n {count} {txt}"
-            if fo:
-                fo.write(txt + '\n')
-            else:
-                print(txt)
-            s.print_words(fo=fo)
+            lines.append(txt + '\n')
+            lines.append(s.words_str())
             if not fo:
-                print()
+                lines.append('\n')
+        (fo or sys.stdout).write(''.join(lines))
 
 
 class SentenceNode:
     """ A sentence is a list of words """
+    __slots__ = ('word_nodes', 'text', 'doc', 'has_there')
 
     def __init__(self, doc: UdDoc):
         self.word_nodes = []  # list of word nodes - actual nodes, not names
         self.text = ""    # the original text - a string
         self.doc = doc      # document object
+        # only sentences with 'there' can be existential, see make_copula
+        # any 'there' counts, rewriting can make a 'there' into expl
+        self.has_there = False
 
     def print_words(self, fo=None):
-        w: WordNode
-        for w in self.word_nodes:
-            w.display_word(fo=fo)
+        txt = self.words_str()  # one write per sentence instead of one per word
+        if fo:
+            fo.write(txt)
+        else:
+            print(txt, end='')
+
+    def words_str(self):
+        return ''.join(w.display_word_str() + '\n' for w in self.word_nodes)
 
 
 class WordNode:
-    wn_count = 0
-    all_wn = []
+    __slots__ = ('wn_id', 'index', 'index_span', 'text', 'sentence_node', 'lemma', 'upos', 'feats', 'span', 'ner',
+                 'ner_head_word', 'dependency_relation', 'governor', 'governor_word', 'dependents')
+    wn_ids = itertools.count()  # unique word node ids, does not keep references to word nodes
 
     def __init__(self, index, text, sentence_node):
-        self.wn_id = WordNode.wn_count
-        WordNode.wn_count += 1
-        WordNode.all_wn.append(self)
+        self.wn_id = next(WordNode.wn_ids)
         self.index = index   # in the sentence 1-based self.start_index = self.index
         self.index_span = [self.index, self.index]
         self.text = text  # string, word text
         self.sentence_node = sentence_node  # the parent sentence instance
         self.lemma = None
         self.upos = None     # universal pos tag
-        self.features = {}  # {feature-name: feature-value}
+        self.feats = ""  # features in UD format, e.g., 'Number=Sing|Person=3', see features
         self.span = None     # word span in characters, [start_char, end_char] with respect to the document
         # if the word node is the head of the NER from Spacy, the NER info is recorded
-        self.ner = None  # {text: phrase_text, words: [words], span: phrase_span, type: phrase_type}
+        self.ner = None  # NerInfo
         self.ner_head_word = None
         # UD tree has dependency edges from dependent nodes to their governors labeled with the dependency relation
         # these come from the underlying UD parser (e.g., Stanza)
         self.dependency_relation = None  # such as 'nsubj', 'obj', etc
         self.governor = None  # 1-based index in sentence
-        self.governor_word = None  # set by add_dominates
+        self.governor_word = None  # set by spacy_to_ud_sentence
+        self.dependents = []  # words whose governor_word is this word, in sentence order, kept up by set_governor
+
+    @property
+    def features(self):
+        """ {feature-name: feature-value} made from feats on demand """
+        if not self.feats:
+            return _EMPTY_FEATS  # most words have no features
+        return dict(feat.split('=', 1) for feat in self.feats.split('|'))
 
     def display_word(self, fo=None):
-        res = f"{self.index}\t{self.text}\tlemma: {self.lemma}\tpos: {self.upos}"
-        res = res + f"\tdep: {self.dependency_relation}\tgov: {self.governor}"
-        feats = ""
-        for f_name, f_val in self.features.items():
-            feats += f"{f_name}={f_val}|"
-        feats = feats.strip('|')
-        if not feats:
-            feats = 'None'
-        res += f"\tfeats: {feats}"
-        if self.ner:
-            word_indices = [x.index for x in self.ner.get('words')]
-            res += f"\tNER-type: {self.ner.get('type')}\tNER-words: {word_indices}"
+        res = self.display_word_str()
         if fo:
             fo.write(res + '\n')
         else:
             print(res)
 
+    def display_word_str(self):
+        feats = self.feats or 'None'
+        ner = ""
+        if self.ner:
+            ner = f"\tNER-type: {self.ner.type}\tNER-words: {[x.index for x in self.ner.words]}"
+        return (f"{self.index}\t{self.text}\tlemma: {self.lemma}\tpos: {self.upos}"
+                f"\tdep: {self.dependency_relation}\tgov: {self.governor}\tfeats: {feats}{ner}")
+
 
 class SpacyParser:
 
-    def __init__(self, lang='en', model_name='en_core_web_trf'):
+    def __init__(self, lang='en', model_name='en_core_web_trf', disable=()):
+        """
+        :param lang: language of the texts
+        :param model_name: Spacy model
+        :param disable: names of Spacy pipeline components that are not run, e.g., ('ner',) if entities are not needed
+        """
         self.language = lang
-        self.nlp = spacy.load(model_name)
+        self._model_name = model_name
+        self._disable = disable
+        self._nlp = None  # the model is loaded on first use of self.nlp
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            self._nlp = spacy.load(self._model_name, disable=self._disable)
+        return self._nlp
+
+    def parse_many(self, texts, batch_size=64, n_process=1, as_ud=True):
+        """
+        Parses many texts at once using nlp.pipe, which is much faster than calling nlp(text) for each text
+        :param texts: iterable of strings
+        :param batch_size: number of texts buffered by Spacy, 50-75 works well for the transformer model
+        :param n_process: number of processes, -1 uses all cores but each process has to load the model first
+        :param as_ud: if True, yields UdDocs, otherwise yields SpacyDocs
+        :return: a generator of UdDocs or SpacyDocs
+        """
+        sp_docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        if as_ud:
+            return (spacy_to_ud_doc(sp_doc) for sp_doc in sp_docs)
+        return sp_docs
+
+    def parse_concat(self, texts, sep='\n\n'):
+        """
+        Parses many short texts (e.g., tweets) with a single nlp call to avoid paying the per-call overhead for each
+        The texts are joined with sep and the parsed doc is cut back into one doc per text
+        Caveat: the parser sees the joined texts, it may attach a word to a word in another text,
+        such a word is made a root in its own text
+        Whitespace at the ends of a text is not part of its doc, an empty text gives an empty UdDoc
+        :param texts: iterable of strings
+        :param sep: separator between the texts, should be a natural sentence break
+        :return: list of UdDocs, one per text
+        """
+        texts = list(texts)
+        char_spans = []
+        start_char = 0
+        for text in texts:
+            char_spans.append((start_char, start_char + len(text)))
+            start_char += len(text) + len(sep)
+        sp_doc = self.nlp(sep.join(texts))
+        ud_docs = []
+        for start_char, end_char in char_spans:
+            # 'contract' leaves out the whitespace tokens of the separator that can overlap the ends of a text
+            span = sp_doc.char_span(start_char, end_char, alignment_mode='contract')
+            if not span:
+                ud_docs.append(UdDoc())
+                continue
+            text_doc = span.as_doc()
+            for token in span:
+                if not span.start <= token.head.i < span.end:
+                    # as_doc makes such a word its own head but keeps its label, which UD rules would follow
+                    text_doc[token.i - span.start].dep_ = 'ROOT'
+            ud_docs.append(spacy_to_ud_doc(text_doc))
+        return ud_docs
 
 
 def print_spacy_doc(sp_doc: spacy.tokens.Doc):
@@ -128,53 +226,57 @@ def print_spacy_doc(sp_doc: spacy.tokens.Doc):
 
 
 def morph_to_string(token):
-    f_dict = token.morph.to_dict()
-    f_str = ""
-    for f_name, f_val in f_dict.items():
-        f_str += f"{f_name}={f_val}|"
-    f_str = f_str.strip('|')
-    if not f_str:
-        f_str = 'None'
-    return f_str
+    return str(token.morph) or 'None'
 
 
 def spacy_to_ud_doc(sp_doc: SpacyDoc):
     doc = UdDoc()
-    spacy_sentence: SpacyDoc
-    spacy_sentences = [x for x in sp_doc.sents]
-    if not spacy_sentences:
-        # if spacy_doc is not divided into sentences then the whole doc is the sentence
-        spacy_sentences = [sp_doc]
-    for spacy_sentence in spacy_sentences:
+    for spacy_sentence in sp_doc.sents:
         spacy_to_ud_sentence(spacy_sentence, doc)
+    if not doc.sentences:
+        # if spacy_doc is not divided into sentences then the whole doc is the sentence
+        spacy_to_ud_sentence(sp_doc, doc)
     return doc
 
 
 def spacy_to_ud_sentence(spacy_sent: SpacyDoc, doc: UdDoc):
     ud_sent = SentenceNode(doc)
     ud_sent.text = spacy_sent.text
-    spacy_token: spacy.tokens.Token
+    words_by_index = {}  # word index -> word node, to add governor words without searching the sentence
     for spacy_token in spacy_sent:
         new_word = WordNode(spacy_token.i + 1, spacy_token.text, ud_sent)
         spacy_to_ud_token(new_word, spacy_token)  # keeps some Spacy dependencies
         ud_sent.word_nodes.append(new_word)  # transforms dependencies
-    add_governor_word(ud_sent)
+        words_by_index[new_word.index] = new_word
+        if new_word.lemma == 'there':
+            ud_sent.has_there = True
+    for word_node in ud_sent.word_nodes:
+        if word_node.governor > 0:
+            gov_node = words_by_index[word_node.governor]
+            word_node.governor_word = gov_node
+            gov_node.dependents.append(word_node)
     spacy_to_ud(ud_sent)
     add_entities(ud_sent, spacy_sent)
     doc.sentences.append(ud_sent)
 
 
+# Spacy dependency relations that are renamed in UD, the rest are kept as is
+_SPACY2UD_DEP = {'dobj': 'obj', 'dative': 'iobj', 'nsubjpass': 'nsubj:pass', 'csubjpass': 'csubj:pass', 'ROOT': 'root',
+                 'auxpass': 'aux:pass', 'preconj': 'pre:conj', 'prt': 'compound:prt', 'predet': 'det:predet',
+                 'poss': 'nmod:poss', 'relcl': 'acl:relcl', 'neg': 'advmod', 'quantmod': 'compound'}
+
+
 def spacy_to_ud_token(word_node: WordNode, spacy_token: spacy.tokens.Token):
-    word_node.upos = spacy_token.pos_
-    word_node.lemma = spacy_token.lemma_
+    # interned upos tags and lemmas are the same objects as identifier-like constants such as 'NOUN' or 'be', so
+    # the tests such as word_node.lemma == 'be' compare by identity, other constants such as '$' are compared as usual
+    word_node.upos = sys.intern(spacy_token.pos_)
+    word_node.lemma = sys.intern(spacy_token.lemma_)
     s_dep = spacy_token.dep_
-    dep_dict = {'dobj': 'obj', 'dative': 'iobj', 'nsubjpass': 'nsubj:pass', 'csubjpass': 'csubj:pass', 'ROOT': 'root',
-                'auxpass': 'aux:pass', 'preconj': 'pre:conj', 'prt': 'compound:prt', 'predet': 'det:predet',
-                'poss': 'nmod:poss', 'relcl': 'acl:relcl', 'neg': 'advmod', 'quantmod': 'compound',
-                'parataxis': 'prataxis'}
-    dep = dep_dict.get(s_dep, s_dep)
-    word_node.dependency_relation = dep
-    spacy_head: spacy.tokens.Token
+    dep = _SPACY2UD_DEP.get(s_dep, s_dep)
+    # Spacy returns a new string every time, an interned relation is the same object as an identifier-like constant
+    # such as 'nsubj' in _DISPATCH, _SUBJ_RELS, etc., which CPython interns, so those compare by identity
+    # constants with a colon such as 'nsubj:pass' are not interned and are still compared char by char
+    word_node.dependency_relation = sys.intern(dep)
     spacy_head = spacy_token.head
     if spacy_head == spacy_token:
         word_node.governor = 0
@@ -183,17 +285,7 @@ def spacy_to_ud_token(word_node: WordNode, spacy_token: spacy.tokens.Token):
     start_char = spacy_token.idx
     end_char = start_char + len(spacy_token.text)
     word_node.span = [start_char, end_char]
-    word_node.features = spacy_token.morph.to_dict()
-
-
-def add_governor_word(sent: SentenceNode):
-    # add governor word to each word
-    word_node: WordNode
-    for word_node in sent.word_nodes:
-        gov_ind = word_node.governor
-        if gov_ind > 0:
-            gov_word = sent.word_nodes[gov_ind - 1]
-            word_node.governor_word = gov_word
+    word_node.feats = str(spacy_token.morph)  # Spacy keeps features as a UD string, no need to make a dict
 
 
 """
@@ -211,42 +303,10 @@ When the implied subject of the clausal complement is the same as the subject of
 def spacy_to_ud(sent: SentenceNode):
     """ we need to convert Spacy dependencies to Universal dependencies
     """
-    word_node: WordNode
-    prep_node: WordNode
-    verb_node: WordNode
     for word_node in sent.word_nodes:
-        if word_node.dependency_relation == 'expl':
-            expl_to_ud(word_node)
-        elif word_node.dependency_relation == 'aux':
-            aux_to_ud(word_node)
-        elif word_node.dependency_relation == 'oprd':
-            oprd_to_ud(word_node)
-        elif word_node.dependency_relation == 'amod':
-            amod_to_ud(word_node)
-        elif word_node.dependency_relation == 'nmod':
-            nmod_to_ud(word_node)
-        elif word_node.dependency_relation == 'nummod':
-            nummod_to_ud(word_node)
-        elif word_node.dependency_relation == 'advcl':
-            advcl_to_ud(word_node)
-        elif word_node.dependency_relation == 'pobj':
-            pobj_to_ud(word_node)
-        elif word_node.dependency_relation == 'pcomp':
-            pcomp_to_ud(word_node)
-        elif word_node.dependency_relation in ['xcomp', 'ccomp']:
-            comp_to_ud(word_node)
-        elif word_node.dependency_relation == 'attr':
-            attr_to_ud(word_node)
-        elif word_node.dependency_relation == 'acomp':
-            acomp_to_ud(word_node)
-        elif word_node.dependency_relation == 'advmod':
-            advmod_to_ud(word_node)
-        elif word_node.dependency_relation == 'npadvmod':
-            npadvmod_to_ud(word_node)
-        elif word_node.dependency_relation == 'conj':
-            conj_to_ud(word_node)
-        elif word_node.dependency_relation == 'dep':
-            dep_to_ud(word_node)
+        handler = _DISPATCH.get(word_node.dependency_relation)
+        if handler:
+            handler(word_node)
     fix_advmod_cop(sent)
 
 
@@ -266,27 +326,22 @@ To match UD in the first sentence, we need to find the first prep attached to th
 def expl_to_ud(word_node: WordNode):
     if word_node.lemma != 'there':
         return
-    be_node: WordNode
     be_node = word_node.governor_word
     if be_node.lemma != 'be':
         return
-    subj_node: WordNode
     subj_node = find_subj(be_node)
     if not subj_node:
         subj_node = find_governed(be_node, 'attr')
     if not subj_node:
         return
     i = subj_node.index
-    prep_node: WordNode
-    sent: SentenceNode
     sent = word_node.sentence_node
     if len(sent.word_nodes) <= i:
         return  # sentence ends without a preposition following nsubj
     prep_node = sent.word_nodes[i]  # indexes are 1-based, this is the i+1 word
-    if prep_node.upos != 'ADP' or prep_node.governor_word != subj_node:
+    if prep_node.upos != 'ADP' or prep_node.governor_word is not subj_node:
         return
-    prep_node.governor = be_node.index
-    prep_node.governor_word = be_node  # pobj_to_ud will make the dependency obl
+    set_governor(prep_node, be_node)  # pobj_to_ud will make the dependency obl
 
 
 def aux_to_ud(word_node: WordNode):
@@ -295,7 +350,6 @@ def aux_to_ud(word_node: WordNode):
     """
     if word_node.upos == 'PART':
         word_node.dependency_relation = 'mark'
-        gov_node: WordNode
         gov_node = word_node.governor_word
         if gov_node.dependency_relation == 'acl:relcl':
             gov_node.dependency_relation = 'acl'
@@ -306,7 +360,7 @@ def oprd_to_ud(word_node: WordNode):
         I had a dog named Fido
         Entering the room sad is not recommended
     """
-    if word_node.upos in ['NOUN', 'PRON', 'PROPN']:
+    if word_node.upos in _NOMINAL:
         word_node.dependency_relation = 'obj'
     else:
         word_node.dependency_relation = 'advcl'
@@ -321,7 +375,6 @@ Sometimes, Spacy uses 'amod' to modify verbs where it should be 'xcomp'. In UD,
 
 
 def amod_to_ud(word_node: WordNode):
-    gov_node: WordNode
     gov_node = word_node.governor_word
     if gov_node.upos == 'VERB':
         word_node.dependency_relation = 'xcomp'
@@ -341,15 +394,12 @@ Spacy's output in inconsistent and needs to be corrected
 
 
 def nmod_to_ud(word_node: WordNode):
-    gov_node: WordNode
     gov_node = word_node.governor_word
     if word_node.lemma == '$' and gov_node.upos == 'NUM':
         word_node.dependency_relation = gov_node.dependency_relation
-        word_node.governor = gov_node.governor
-        word_node.governor_word = gov_node.governor_word
+        set_governor(word_node, gov_node.governor_word)
         gov_node.dependency_relation = 'nummod'
-        gov_node.governor = word_node.index
-        gov_node.governor_word = word_node
+        set_governor(gov_node, word_node)
         redirect_dependants(gov_node, word_node)
 
 
@@ -365,7 +415,6 @@ We need to check if the governor of 'nummod' is a NOUN immediately preceding the
 
 
 def nummod_to_ud(word_node: WordNode):
-    gov_node: WordNode
     gov_node = word_node.governor_word
     if gov_node.upos == 'NOUN' and gov_node.index == word_node.index - 1:
         word_node.dependency_relation = 'nmod'
@@ -385,28 +434,26 @@ Copula
 Except when WN has no subject as in:
 'Let's face it, we are tired'
     Spacy: WN (VERB let) -advcl-> BE (are) <-acomp- (ADJ tired)
-    UD: (VERB let) <-prataxis- (ADJ tired)
+    UD: (VERB let) <-parataxis- (ADJ tired)
 
     There are two issues here:
     (1) should (VERB let) or (ADJ tired) be the root?
         if we had 'We are tired, let's face it', (ADJ tired) would be the root
         it really should not matter which one is the root
-    (2) how do we get 'prataxis' from 'advcl'?
+    (2) how do we get 'parataxis' from 'advcl'?
         maybe we shouldn't
 """
 
 
 def advcl_to_ud(word_node: WordNode):
-    gov_node: WordNode
     gov_node = word_node.governor_word
     if gov_node.lemma == 'be' and find_subj(word_node):  # subj may be too weak a filter
         make_copula(word_node, gov_node)
         # now word_node is the head of the copula
-        csubj_node: WordNode
         csubj_node = find_governed(word_node, 'csubj')
         if csubj_node and csubj_node.upos == 'VERB':
             csubj_node.dependency_relation = 'csubj:outer'
-    elif gov_node.upos in ['NOUN', 'PRON', 'PROPN'] and not find_governed(gov_node, 'cop'):
+    elif gov_node.upos in _NOMINAL and not find_governed(gov_node, 'cop'):
         word_node.dependency_relation = 'acl'
 
 
@@ -458,20 +505,18 @@ There are several cases to consider:
     Copula: PRON (he) -nsubj-> VERB (claimed) <-xcomp- NOUN (wizard) <-cop- be
     This is a proper UD
 
-Prataxis
-Spacy uses 'parataxes' while UD uses 'prataxis'
-It may be hard to distinguish between ccomp and prataxis as in:
+Parataxis
+Spacy and UD both use 'parataxis'
+It may be hard to distinguish between ccomp and parataxis as in:
 'Let's face it, we are annoyed'
     Spacy: (VERB let) -advacl-> BE (AUX are) <-acomp- (ADJ annoyed)
-    UD: (VERB let) <-prataxis- (ADJ annoyed)
+    UD: (VERB let) <-parataxis- (ADJ annoyed)
 """
 
 
 def comp_to_ud(word_node: WordNode):
     """ 'It is very important that your students respect you' """
-    gov_node: WordNode
     gov_node = word_node.governor_word
-    subj_node: WordNode
     subj_node = find_subj(gov_node)  # either nsubj or csubj
     if gov_node.lemma == 'be':
         make_copula(word_node, gov_node)  # now word_node is the head of the copula
@@ -517,8 +562,6 @@ Copula
 
 
 def pobj_to_ud(word_node: WordNode):
-    prep_node: WordNode
-    gov_node: WordNode
     gov_node, prep_nodes = prep_chain(word_node)
     if not prep_nodes:
         print(f"pobj without preps, word: {word_node.text}")
@@ -526,7 +569,7 @@ def pobj_to_ud(word_node: WordNode):
     if not gov_node.lemma == 'be' or not make_copula(word_node, gov_node):
         prep_node = prep_nodes[0]
         if prep_node.dependency_relation == 'prep':
-            if gov_node.upos in ['NOUN', 'PRON', 'PROPN']:
+            if gov_node.upos in _NOMINAL:
                 word_node.dependency_relation = 'nmod'
             else:
                 word_node.dependency_relation = 'obl'
@@ -538,33 +581,28 @@ def pobj_to_ud(word_node: WordNode):
             print(
                 f"Unknown dep from PREP in: {gov_node.text} <-{prep_node.dependency_relation}- {prep_node.text} <-pobj- {word_node.text}")
             return
-        word_node.governor = gov_node.index
-        word_node.governor_word = gov_node
+        set_governor(word_node, gov_node)
     for prep_node in prep_nodes:
-        prep_node.governor = word_node.index
-        prep_node.governor_word = word_node
+        set_governor(prep_node, word_node)
         prep_node.dependency_relation = 'case'
-        adv_node: WordNode
         adv_node = find_governed(prep_node, 'advmod')
         if adv_node:  # especially on Mondays: ADV (especially) -advmod-> PREP (on)
-            adv_node.governor = word_node.index
-            adv_node.governor_word = word_node
+            set_governor(adv_node, word_node)
 
 
 def prep_chain(word_node: WordNode):
-    x: WordNode
+    """ returns the head of the chain of prepositions above word_node and the prepositions
+        The chain is not cached: pobj_to_ud turns the prepositions into 'case' dependants of word_node right away,
+        so the next pobj sharing a preposition must not see the old chain
+    """
     prep_nodes = []
-    head = None
     x = word_node.governor_word
-    if x.dependency_relation in ['iobj', 'agent']:
+    if x.dependency_relation in _IOBJ_AGENT:
         return x.governor_word, [x]
-    while not head:
-        if x.dependency_relation == 'prep':
-            prep_nodes.append(x)
-            x = x.governor_word
-        else:
-            head = x
-    return head, prep_nodes
+    while x.dependency_relation == 'prep':
+        prep_nodes.append(x)
+        x = x.governor_word
+    return x, prep_nodes
 
 
 """
@@ -595,8 +633,6 @@ When pcomp complements a copula, it becomes its head
 
 
 def pcomp_to_ud(word_node: WordNode):
-    prep_node: WordNode
-    gov_node: WordNode
     prep_node = word_node.governor_word
     if word_node.upos == 'ADP' and prep_node.upos == 'SCONJ':
         word_node.dependency_relation = 'fixed'
@@ -610,10 +646,8 @@ def pcomp_to_ud(word_node: WordNode):
         make_copula(word_node, gov_node)
     else:
         word_node.dependency_relation = 'advcl'
-        word_node.governor = gov_node.index
-        word_node.governor_word = gov_node
-        prep_node.governor = word_node.index
-        prep_node.governor_word = word_node
+        set_governor(word_node, gov_node)
+        set_governor(prep_node, word_node)
     dep = 'case'
     if prep_node.upos == 'SCONJ':
         dep = 'mark'
@@ -636,8 +670,6 @@ Copula
 
 
 def attr_to_ud(word_node: WordNode):
-    be_node: WordNode
-    subj_node: WordNode
     be_node = word_node.governor_word
     if be_node.lemma != 'be':
         print(f"Dep attr used with something other than to be: {be_node.text} <-attr- {word_node.text}")
@@ -669,7 +701,6 @@ Sometimes, Spacy treats a passive as an acomp, which is probably a mistake:
 
 
 def acomp_to_ud(word_node: WordNode):
-    acomp_node: WordNode
     acomp_node = word_node.governor_word
     if acomp_node.lemma == 'be':
         if word_node.upos == 'VERB' and word_node.features.get('Aspect') == 'Perf':
@@ -702,7 +733,8 @@ otherwise, we change SCONJ into ADV
 
 def advmod_to_ud(word_node: WordNode):
     if word_node.upos == 'SCONJ':
-        if word_node.governor_word.dependency_relation == 'advcl':
+        gov_node = word_node.governor_word
+        if gov_node.dependency_relation == 'advcl':
             word_node.dependency_relation = 'mark'
         else:
             word_node.upos = 'ADV'
@@ -741,31 +773,22 @@ VERB <-conj- NOUN2 <-orphan- NOUN1
 
 
 def conj_to_ud(word_node: WordNode):
-    conj_node: WordNode
-    gov_node: WordNode
     gov_node = word_node.governor_word
     conj_node = find_governed(gov_node, 'cc')  # we find the first but there might be more
     if conj_node:
-        conj_node.governor = word_node.index
-        conj_node.governor_word = word_node
-    if gov_node.upos == 'VERB' and word_node.upos in ['NOUN', 'PRON', 'PROPN']:
-        nsubj_node: WordNode
+        set_governor(conj_node, word_node)
+    if gov_node.upos == 'VERB' and word_node.upos in _NOMINAL:
         nsubj_node = find_governed(word_node, 'nsubj')  # NOUN2 above
         if nsubj_node:
             nsubj_node.dependency_relation = 'conj'
-            nsubj_node.governor = gov_node.index
-            nsubj_node.governor_word = gov_node
+            set_governor(nsubj_node, gov_node)
             word_node.dependency_relation = 'orphan'
-            word_node.governor = nsubj_node.index
-            word_node.governor_word = nsubj_node
+            set_governor(word_node, nsubj_node)
             if conj_node:
-                conj_node.governor = nsubj_node.index
-                conj_node.governor_word = nsubj_node
+                set_governor(conj_node, nsubj_node)
     if gov_node.dependency_relation == 'conj':
-        gov_gov_node: WordNode
         gov_gov_node = gov_node.governor_word
-        word_node.governor = gov_gov_node.index
-        word_node.governor_word = gov_gov_node
+        set_governor(word_node, gov_gov_node)
 
 
 """
@@ -824,13 +847,11 @@ We still need to transform a chain of npadvmod's into a parallel obl:npmod depen
 
 
 def npadvmod_to_ud(word_node: WordNode):
-    gov_node: WordNode
     gov_node = word_node.governor_word
     if gov_node.dependency_relation == 'obl:npmod':
         gov_node = gov_node.governor_word
     word_node.dependency_relation = 'obl:npmod'
-    word_node.governor = gov_node.index
-    word_node.governor_word = gov_node
+    set_governor(word_node, gov_node)
 
 
 """ compound vs flat
@@ -873,12 +894,18 @@ I don't see any point in changing 'appos' into 'list'
 
 def dep_to_ud(word_node: WordNode):
     """ this may be a hack, we need to see more cases of dep: dep"""
-    gov_node: WordNode
     gov_node = word_node.governor_word
     if gov_node.upos == 'VERB':
         word_node.dependency_relation = 'ccomp'
 
 
+# Spacy dependency relation -> function transforming it to UD, used by spacy_to_ud
+_DISPATCH = {'expl': expl_to_ud, 'aux': aux_to_ud, 'oprd': oprd_to_ud, 'amod': amod_to_ud, 'nmod': nmod_to_ud,
+             'nummod': nummod_to_ud, 'advcl': advcl_to_ud, 'pobj': pobj_to_ud, 'pcomp': pcomp_to_ud,
+             'xcomp': comp_to_ud, 'ccomp': comp_to_ud, 'attr': attr_to_ud, 'acomp': acomp_to_ud,
+             'advmod': advmod_to_ud, 'npadvmod': npadvmod_to_ud, 'conj': conj_to_ud, 'dep': dep_to_ud}
+
+
 """
 We don't create copulas from adverbs during the first pass because there may be several adverbs
 Spacy attaches all of them to the BE node via advmod
@@ -894,10 +921,10 @@ If there are several such adverbs, we want the last to be the head of the copula
 
 
 def fix_advmod_cop(sent: SentenceNode):
-    word_node: WordNode
+    # one pass, make_copula only looks at the dependents of gov_node
+    # the order matters: when the last advmod becomes the head, the other advmods of BE are redirected to it
     for word_node in reversed(sent.word_nodes):
         if word_node.dependency_relation == 'advmod':
-            gov_node: WordNode
             gov_node = word_node.governor_word
             if gov_node.lemma == 'be' and gov_node.dependency_relation != 'cop':
                 make_copula(word_node, gov_node)
@@ -905,17 +932,15 @@ def fix_advmod_cop(sent: SentenceNode):
 
 def make_copula(head_node: WordNode, be_node: WordNode):
     # UD does not convert existential predications into copulas
-    expl_node: WordNode
-    expl_node = find_governed(be_node, 'expl')
-    if expl_node and expl_node.lemma == "there":
-        return False
+    if be_node.sentence_node.has_there:
+        expl_node = find_governed(be_node, 'expl')
+        if expl_node and expl_node.lemma == "there":
+            return False
     # make head_node the copula predicate and move governor dependency from be_node to head_node
-    head_node.governor = be_node.governor
-    head_node.governor_word = be_node.governor_word
+    set_governor(head_node, be_node.governor_word)
     head_node.dependency_relation = be_node.dependency_relation
     # make be_node dependent (cop) on head_node
-    be_node.governor = head_node.index
-    be_node.governor_word = head_node
+    set_governor(be_node, head_node)
     be_node.dependency_relation = 'cop'
     be_node.upos = 'AUX'
     redirect_dependants(be_node, head_node)  # if X is dependent on be_node then make it dependent on head_node
@@ -923,80 +948,91 @@ def make_copula(head_node: WordNode, be_node: WordNode):
 
 
 def redirect_dependants(from_node: WordNode, to_node: WordNode):
-    sent: SentenceNode
-    sent = from_node.sentence_node
-    word_node: WordNode
-    for word_node in sent.word_nodes:
-        if word_node == from_node or word_node == to_node:
+    for word_node in list(from_node.dependents):  # a copy, set_governor changes from_node.dependents
+        if word_node is from_node or word_node is to_node:
             continue
-        if word_node.governor_word == from_node:
-            if word_node.dependency_relation in ['prep', 'attr', 'advcl', 'advmod', 'acomp', 'xcomp', 'dep', 'acl',
-                                                 'nsubj', 'obj', 'csubj', 'ccomp', 'mark', 'cop', 'npadvmod', 'conj',
-                                                 'prataxis', 'punct', 'cc', 'nsubj:outer', 'csubj:outer']:
-                word_node.governor = to_node.index
-                word_node.governor_word = to_node
+        if word_node.dependency_relation in _REDIRECTABLE_DEPS:
+            set_governor(word_node, to_node)
 
 
 def make_passive(be_node: WordNode, verb_node: WordNode):
-    subj_node: WordNode
     subj_node = find_governed(be_node, 'nsubj')
     rel = 'nsubj:pass'
     if not subj_node:
         subj_node = find_governed(be_node, 'csubj')
         rel = 'csubj:pass'
     if subj_node:
-        subj_node.governor = verb_node.index
-        subj_node.governor_word = verb_node
+        set_governor(subj_node, verb_node)
         subj_node.dependency_relation = rel
-    verb_node.governor = be_node.governor
-    verb_node.governor_word = be_node.governor_word
+    set_governor(verb_node, be_node.governor_word)
     verb_node.dependency_relation = be_node.dependency_relation
-    be_node.governor = verb_node.index
-    be_node.governor_word = verb_node
+    set_governor(be_node, verb_node)
     be_node.dependency_relation = 'aux:pass'
 
 
+def set_governor(word_node: WordNode, gov_node: WordNode):
+    """ makes gov_node (None for the root) the governor of word_node and updates dependents of both governors """
+    old_gov_node = word_node.governor_word
+    if old_gov_node:
+        old_gov_node.dependents.remove(word_node)
+    word_node.governor_word = gov_node
+    if gov_node:
+        word_node.governor = gov_node.index
+        bisect.insort(gov_node.dependents, word_node, key=_word_index)
+    else:
+        word_node.governor = 0
+
+
 def find_governed(word_node: WordNode, dep):
-    sent = word_node.sentence_node
-    wn: WordNode
-    for wn in sent.word_nodes:
-        if wn.governor_word == word_node and wn.dependency_relation == dep:
+    for wn in word_node.dependents:
+        if wn.dependency_relation == dep:
             return wn
     return None
 
 
 def find_subj(word_node: WordNode):
-    sent = word_node.sentence_node
-    wn: WordNode
-    for wn in sent.word_nodes:
-        if wn.governor_word == word_node and\
-                wn.dependency_relation in ['nsubj', 'csubj', 'nsubj:pass', 'csubj:pass', 'nsubj:outer', 'csubj:outer']:
+    for wn in word_node.dependents:
+        if wn.dependency_relation in _SUBJ_RELS:
             return wn
     return None
 
 
 def add_entities(sent: SentenceNode, spacy_sent: SpacyDoc):
     # add extracted NERs
-    spacy_span: spacy.tokens.Span
-    for spacy_span in spacy_sent.ents:
-        span_word_nodes = find_span_words(sent, spacy_span)
-        phrase_head_word = None
-        for word_node in span_word_nodes:
-            if word_node.governor_word is None or word_node.governor_word not in span_word_nodes:
-                phrase_head_word = word_node
-                word_node.ner = {'text': spacy_span.text, 'words': span_word_nodes,
-                                 'span': [spacy_span.start_char, spacy_span.end_char], 'type': spacy_span.label_}
-                break
+    spacy_spans = spacy_sent.ents
+    if not spacy_spans:
+        return
+    word_starts = [word_node.span[0] for word_node in sent.word_nodes]  # sorted, words are in text order
+    for spacy_span in spacy_spans:
+        span_word_nodes = find_span_words(sent, spacy_span, word_starts)
+        span_word_set = set(span_word_nodes)
+        # the head is the first word governed from outside the span (or the root)
+        phrase_head_word = next((w for w in span_word_nodes if w.governor_word not in span_word_set), None)
+        if phrase_head_word:
+            phrase_head_word.ner = NerInfo(spacy_span.text, span_word_nodes, spacy_span.start_char,
+                                           spacy_span.end_char, spacy_span.label_)
         for word_node in span_word_nodes:
-            if word_node != phrase_head_word:
+            if word_node is not phrase_head_word:
                 word_node.ner_head_word = phrase_head_word
 
 
-def find_span_words(sent: SentenceNode, spacy_span: spacy.tokens.Span):
-    """ returns word nodes that are within Spacy span"""
-    span_words = []
-    for word_node in sent.word_nodes:
-        if word_node.span[0] >= spacy_span.start_char and word_node.span[1] <= spacy_span.end_char:
-            span_words.append(word_node)
-    return span_words
-
+def find_span_words(sent: SentenceNode, spacy_span: spacy.tokens.Span, word_starts=None):
+    """ returns word nodes that are within Spacy span
+        word_starts are the start chars of the words in the sentence, made once per sentence by add_entities
+    """
+    if word_starts is None:
+        word_starts = [word_node.span[0] for word_node in sent.word_nodes]
+    lo = bisect.bisect_left(word_starts, spacy_span.start_char)
+    hi = bisect.bisect_right(word_starts, spacy_span.end_char)
+    return [word_node for word_node in sent.word_nodes[lo:hi] if word_node.span[1] <= spacy_span.end_char]
+
+
+if __name__ == '__main__':
+    # parses the development sentences in batches and prints them in the format of ud_sentences_parses_curated.txt
+    # usage: python main.py [n_process], one process by default, every extra process loads its own copy of the model
+    n_process = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    spr = SpacyParser()
+    with open('ud_sentences.txt') as fi:
+        texts = [line.strip() for line in fi if line.strip()]
+    for i, ud_doc in enumerate(spr.parse_many(texts, n_process=n_process), 1):
+        ud_doc.print_doc(count=i)